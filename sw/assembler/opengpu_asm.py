@@ -10,14 +10,39 @@ Instruction formats (32-bit):
   U-Type: [31:26] opcode | [25:21] rd | [20:0] imm21
 
 Usage: python opengpu_asm.py input.asm [output.hex]
+
+The module is fully type-annotated so it can be compiled with mypyc
+(make assembler-native). Set OPENGPU_ASM_NATIVE=1 to run the compiled
+extension built next to this file instead of the source; it is ignored when
+this file is newer than the build.
 """
 
+import importlib.machinery
+import importlib.util
+import os
 import sys
-import re
+from array import array
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
-
-OPCODES = {
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Sequence, TextIO, Tuple
+
+if __name__ == '__main__' and os.environ.get('OPENGPU_ASM_NATIVE') == '1':
+    # Hand over to the mypyc build in this directory before running any of the
+    # module-level setup below, unless the source has been edited since
+    _here = os.path.abspath(__file__)
+    for _suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        _native = os.path.join(os.path.dirname(_here), 'opengpu_asm' + _suffix)
+        if os.path.exists(_native) and os.path.getmtime(_native) >= os.path.getmtime(_here):
+            _spec = importlib.util.spec_from_file_location('opengpu_asm', _native)
+            if _spec is not None and _spec.loader is not None:
+                _mod = importlib.util.module_from_spec(_spec)
+                _spec.loader.exec_module(_mod)
+                _mod.main()
+                sys.exit(0)
+    print("OPENGPU_ASM_NATIVE: no up-to-date native build, using the Python source",
+          file=sys.stderr)
+
+OPCODES: Dict[str, Optional[int]] = {
     'ADD': 0x00, 'ADDI': 0x01, 'SUB': 0x02,
     'MUL': 0x03, 'MULH': 0x04, 'DIV': 0x05,
     'DIVU': 0x06, 'REM': 0x07, 'REMU': 0x08,
@@ -50,17 +75,28 @@ R_TYPE = {'ADD', 'SUB', 'MUL', 'MULH', 'DIV', 'DIVU', 'REM', 'REMU',
           'AND', 'OR', 'XOR', 'NOT', 'SLL', 'SRL', 'SRA',
           'SLT', 'SLTU', 'SEQ', 'SNE', 'SGE', 'SGEU'}
 I_TYPE = {'ADDI', 'ANDI', 'ORI', 'XORI', 'SLLI', 'SRLI', 'SRAI', 'SLTI', 'SLTIU', 'JALR'}
+I_TYPE_ZEXT = {'ANDI', 'ORI', 'XORI'}  # imm16 zero-extended; the rest sign-extend
 MEM_LOAD = {'LW', 'LH', 'LHU', 'LB', 'LBU'}
 MEM_STORE = {'SW', 'SH', 'SB'}
 B_TYPE = {'BEQ', 'BNE', 'BLT', 'BGE', 'BLTU', 'BGEU'}
 U_TYPE = {'LUI', 'AUIPC', 'JAL'}
-CTRL_TYPE = {'RET'}
 # FPU instruction sets
 FPU_R2 = {'FADD', 'FSUB', 'FMUL', 'FDIV', 'FMIN', 'FMAX', 'FCMPEQ', 'FCMPLT', 'FCMPLE'}  # 2 operands
 FPU_R1 = {'FABS', 'FNEG', 'FSQRT', 'FCVTWS', 'FCVTSW'}  # 1 operand
 FPU_R3 = {'FMADD', 'FMSUB'}  # 3 operands (rd = rs1 * rs2 + rs3)
 
-REGISTERS = {
+
+class _RegisterFile(Dict[str, int]):
+    # Misses fall back to case-insensitive lookup, then report a bad register,
+    # so the encoders can index REGISTERS directly.
+    def __missing__(self, reg_str: str) -> int:
+        name = reg_str.upper().strip()
+        if name in self:
+            return self[name]
+        raise ValueError(f"Unknown register: {name}")
+
+
+REGISTERS = _RegisterFile({
     'X0': 0, 'ZERO': 0,
     'X1': 1, 'THREADIDX': 1, 'TID': 1,
     'X2': 2, 'BLOCKIDX': 2, 'BID': 2,
@@ -71,7 +107,161 @@ REGISTERS = {
     **{f'X{i}': i for i in range(7, 32)},
     'T0': 7, 'T1': 8, 'T2': 9, 'T3': 10, 'T4': 11,
     'T5': 12, 'T6': 13, 'T7': 14, 'T8': 15,
-}
+})
+# Accept lowercase names directly so the common case needs no .upper()
+REGISTERS.update({name.lower(): idx for name, idx in list(REGISTERS.items())})
+
+# Immediate base by literal prefix; anything else is decimal
+_RADIX = {'0x': 16, '0X': 16, '0b': 2, '0B': 2}
+
+
+def parse_register(reg_str: str) -> int:
+    return REGISTERS[reg_str]
+
+
+# "offset(reg)" with optional offset. The grammar is small enough to scan by
+# hand, and the same few operands ("0(x7)", "4(T0)", ...) recur throughout a
+# program, so results are cached.
+@lru_cache(maxsize=4096)
+def parse_memory_operand(operand: str) -> Tuple[int, int]:
+    lp = operand.find('(')
+    rp = operand.find(')', lp + 1)
+    # The offset is an optional '-' and decimal digits; int() alone would also
+    # take '+4' and '1_0'
+    digits = operand[1:lp] if operand[:1] == '-' else operand[:lp]
+    if lp < 0 or rp < 0 or (lp and not digits.isdecimal()):
+        raise ValueError(f"Invalid memory operand: {operand}")
+    offset = int(operand[:lp]) if lp else 0
+    if (offset + 0x8000) >> 16:
+        raise ValueError(f"Memory offset out of 16-bit signed range: {offset}")
+    return offset, REGISTERS[operand[lp + 1:rp]]
+
+
+# Per-format encoders. Each takes the opcode already shifted into [31:26]
+# first so the dispatch table below can bind it once with partial(); the
+# remaining arguments are the assembler (for labels and the current address)
+# and the instruction operands. Fields are packed inline, so these handlers are
+# the only encoders.
+#
+# Immediates are range-checked with shifts instead of chained compares,
+# following how the decoder extends each field: "(x + 2**(n-1)) >> n" is
+# non-zero exactly when x does not fit in n signed bits (sign-extended
+# fields), and "x >> n" is non-zero exactly when x is not an n-bit unsigned
+# value (zero-extended or raw fields). In-range values are then truncated to
+# the field with a mask.
+def _encode_rrr(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    return base | (REGISTERS[ops[0]] << 21) | (REGISTERS[ops[1]] << 16) | (REGISTERS[ops[2]] << 11)
+
+
+def _encode_rr(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    return base | (REGISTERS[ops[0]] << 21) | (REGISTERS[ops[1]] << 16)
+
+
+def _encode_rri(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    imm = asm.parse_immediate(ops[2], asm.labels)
+    if (imm + 0x8000) >> 16:
+        raise ValueError(f"Immediate out of 16-bit signed range: {imm}")
+    return base | (REGISTERS[ops[0]] << 21) | (REGISTERS[ops[1]] << 16) | (imm & 0xFFFF)
+
+
+# ANDI/ORI/XORI zero-extend imm16
+def _encode_rri_zext(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    imm = asm.parse_immediate(ops[2], asm.labels)
+    if imm >> 16:
+        raise ValueError(f"Immediate out of 16-bit unsigned range: {imm}")
+    return base | (REGISTERS[ops[0]] << 21) | (REGISTERS[ops[1]] << 16) | imm
+
+
+# Loads and stores share one layout: the S-type rs2 sits in [25:21], the same
+# field as the I-type rd, so ops[0] is the destination or the stored register
+def _encode_mem(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    offset, rs1 = parse_memory_operand(ops[1])
+    return base | (REGISTERS[ops[0]] << 21) | (rs1 << 16) | (offset & 0xFFFF)
+
+
+# B-Type: rs2 goes in the cond field [25:21], rs1 in [20:16]
+def _encode_branch(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    offset = asm.parse_immediate(ops[2], asm.labels, asm.current_address, relative=True)
+    if (offset + 0x8000) >> 16:
+        raise ValueError(f"Branch offset out of 16-bit range: {offset}")
+    return base | (REGISTERS[ops[1]] << 21) | (REGISTERS[ops[0]] << 16) | (offset & 0xFFFF)
+
+
+def _encode_jal(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    offset = asm.parse_immediate(ops[1], asm.labels, asm.current_address, relative=True)
+    if (offset + 0x100000) >> 21:
+        raise ValueError(f"Jump offset out of 21-bit range: {offset}")
+    return base | (REGISTERS[ops[0]] << 21) | (offset & 0x1FFFFF)
+
+
+def _encode_upper(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    imm = asm.parse_immediate(ops[1], asm.labels)
+    # imm21 becomes the raw upper bits [31:11] of the result, no extension
+    if imm >> 21:
+        raise ValueError(f"Immediate out of 21-bit unsigned range: {imm}")
+    return base | (REGISTERS[ops[0]] << 21) | imm
+
+
+# Operand-less instructions (NOP, RET) always encode to the same word
+def _encode_const(code: int, asm: 'Assembler', ops: List[str]) -> int:
+    return code
+
+
+# FPU 3-operand (rd, rs1, rs2, rs3) - rs3 encoded in func field [10:6]
+def _encode_fpu3(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    return (base | (REGISTERS[ops[0]] << 21) | (REGISTERS[ops[1]] << 16)
+            | (REGISTERS[ops[2]] << 11) | (REGISTERS[ops[3]] << 6))
+
+
+# Pseudo-instructions, bound to the opcode of the real instruction they expand to
+def _encode_li(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    imm = asm.parse_immediate(ops[1])
+    if (imm + 0x8000) >> 16:
+        raise ValueError(f"LI immediate too large: {imm}")
+    return base | (REGISTERS[ops[0]] << 21) | (imm & 0xFFFF)
+
+
+def _encode_j(base: int, asm: 'Assembler', ops: List[str]) -> int:
+    offset = asm.parse_immediate(ops[0], asm.labels, asm.current_address, relative=True)
+    if (offset + 0x100000) >> 21:
+        raise ValueError(f"Jump offset out of 21-bit range: {offset}")
+    return base | (offset & 0x1FFFFF)
+
+
+Handler = Callable[['Assembler', List[str]], int]
+
+
+def _base(mnemonic: str) -> int:
+    # Opcode of a real instruction, shifted into [31:26]
+    opcode = OPCODES[mnemonic]
+    assert opcode is not None, f"{mnemonic} is a pseudo-instruction"
+    return opcode << 26
+
+
+_NOP_CODE = _base('ADDI')   # ADDI x0, x0, 0
+_RET_CODE = _base('RET')
+
+HANDLERS: Dict[str, Handler] = {}
+for _group, _encoder in ((R_TYPE, _encode_rrr), (I_TYPE - I_TYPE_ZEXT, _encode_rri),
+                         (I_TYPE_ZEXT, _encode_rri_zext), (MEM_LOAD | MEM_STORE, _encode_mem),
+                         (B_TYPE, _encode_branch), (U_TYPE, _encode_upper),
+                         (FPU_R2, _encode_rrr), (FPU_R1, _encode_rr), (FPU_R3, _encode_fpu3)):
+    for _mnemonic in _group:
+        HANDLERS[_mnemonic] = partial(_encoder, _base(_mnemonic))
+HANDLERS['NOT'] = partial(_encode_rr, _base('NOT'))
+HANDLERS['JAL'] = partial(_encode_jal, _base('JAL'))
+HANDLERS['RET'] = partial(_encode_const, _RET_CODE)
+HANDLERS['NOP'] = partial(_encode_const, _NOP_CODE)
+HANDLERS['MV'] = partial(_encode_rr, _base('ADDI'))  # ADDI rd, rs1, 0
+HANDLERS['LI'] = partial(_encode_li, _base('ADDI'))
+HANDLERS['J'] = partial(_encode_j, _base('JAL'))
+
+# Jump table: the tokenizer maps each mnemonic to a small id once, and the
+# emit loop indexes HANDLERS_ARR with it instead of hashing the name again.
+MNEMONICS: Tuple[str, ...] = tuple(OPCODES)
+MNEMONIC_ID: Dict[str, int] = {name: i for i, name in enumerate(MNEMONICS)}
+MNEMONIC_ID.update({name.lower(): i for i, name in enumerate(MNEMONICS)})
+HANDLERS_ARR: Tuple[Handler, ...] = tuple(HANDLERS[name] for name in MNEMONICS)
 
 
 @dataclass
@@ -83,197 +273,146 @@ class Instruction:
     label: Optional[str] = None
 
 
+class InstructionTable:
+    """Tokenized program stored column-wise; row i lives at address 4*i."""
+
+    def __init__(self) -> None:
+        self.line_nums = array('I')
+        self.mnemonic_ids = array('B')
+        self.operands: List[List[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.mnemonic_ids)
+
+    def __getitem__(self, i: int) -> Instruction:
+        return Instruction(self.line_nums[i], i * 4, MNEMONICS[self.mnemonic_ids[i]],
+                           self.operands[i])
+
+    def append(self, line_num: int, mnemonic_id: int, operands: List[str]) -> None:
+        self.line_nums.append(line_num)
+        self.mnemonic_ids.append(mnemonic_id)
+        self.operands.append(operands)
+
+
+def _hex_digits(machine_code: Sequence[int]) -> str:
+    # Hex-encode all words in one go: pack as 32-bit, make big-endian, hexlify
+    words = array('I', machine_code)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words.tobytes().hex()
+
+
 class Assembler:
-    def __init__(self):
+    def __init__(self) -> None:
         self.labels: Dict[str, int] = {}
-        self.instructions: List[Instruction] = []
+        self.instructions = InstructionTable()
         self.current_address = 0
 
     def parse_register(self, reg_str: str) -> int:
-        reg_str = reg_str.upper().strip()
-        if reg_str in REGISTERS:
-            return REGISTERS[reg_str]
-        raise ValueError(f"Unknown register: {reg_str}")
+        return parse_register(reg_str)
 
-    def parse_immediate(self, imm_str: str, labels: Dict[str, int] = None,
+    def parse_immediate(self, imm_str: str, labels: Optional[Dict[str, int]] = None,
                        current_addr: int = 0, relative: bool = False) -> int:
         imm_str = imm_str.strip()
         if labels and imm_str in labels:
             return labels[imm_str] - current_addr if relative else labels[imm_str]
         try:
-            if imm_str.startswith('0x') or imm_str.startswith('0X'):
-                return int(imm_str, 16)
-            elif imm_str.startswith('0b') or imm_str.startswith('0B'):
-                return int(imm_str, 2)
-            return int(imm_str)
+            return int(imm_str, _RADIX.get(imm_str[:2], 10))
         except ValueError:
             raise ValueError(f"Cannot parse immediate: {imm_str}")
 
     def parse_memory_operand(self, operand: str) -> Tuple[int, int]:
-        match = re.match(r'(-?\d+)?\((\w+)\)', operand.strip())
-        if not match:
-            raise ValueError(f"Invalid memory operand: {operand}")
-        offset = int(match.group(1) or '0')
-        reg = self.parse_register(match.group(2))
-        return offset, reg
-
-    def encode_r_type(self, opcode: int, rd: int, rs1: int, rs2: int = 0) -> int:
-        return (opcode << 26) | (rd << 21) | (rs1 << 16) | (rs2 << 11)
+        return parse_memory_operand(operand)
 
-    def encode_i_type(self, opcode: int, rd: int, rs1: int, imm: int) -> int:
-        return (opcode << 26) | (rd << 21) | (rs1 << 16) | (imm & 0xFFFF)
+    def first_pass(self, source: str) -> None:
+        self.current_address = 0
+        self.instructions = InstructionTable()
+        # Commas only separate operands; blank them all in one pass (one copy
+        # of the source) so each instruction body can be split on whitespace
+        # alone
+        source = source.replace(',', ' ')
+        # Walk the source in place with find() and slice out only the code
+        # part of each line, so no list of lines is built. str methods also
+        # beat a per-line regex here.
+        find = source.find
+        size = len(source)
+        pos = 0
+        line_num = 0
+        while pos < size:
+            eol = find('\n', pos)
+            if eol < 0:
+                eol = size
+            line_num += 1
+            comment = find('#', pos, eol)
+            body = source[pos:eol if comment < 0 else comment]
+            pos = eol + 1
+            if ':' in body:
+                label, _, body = body.partition(':')
+                self.labels[label.strip()] = self.current_address
+            parts = body.split()
+            if not parts or parts[0][0] == '.':
+                continue
+            mnemonic_id = MNEMONIC_ID.get(parts[0])
+            if mnemonic_id is None:
+                mnemonic_id = MNEMONIC_ID.get(parts[0].upper())
+                if mnemonic_id is None:
+                    print(f"Error at line {line_num}: {' '.join(parts)}\n  Unknown instruction: {parts[0].upper()}")
+                    raise ValueError(f"Unknown instruction: {parts[0].upper()}")
+            self.instructions.append(line_num, mnemonic_id, parts[1:])
+            self.current_address += 4
 
-    def encode_s_type(self, opcode: int, rs2: int, rs1: int, offset: int) -> int:
-        return (opcode << 26) | (rs2 << 21) | (rs1 << 16) | (offset & 0xFFFF)
+    def second_pass(self) -> 'array[int]':
+        return encode_all(self, self.instructions)
 
-    def encode_b_type(self, opcode: int, rs1: int, rs2: int, offset: int) -> int:
-        return (opcode << 26) | (rs2 << 21) | (rs1 << 16) | (offset & 0xFFFF)
+    def assemble_instruction(self, ins: Instruction) -> int:
+        self.current_address = ins.address
+        handler = HANDLERS.get(ins.mnemonic)
+        if handler is None:
+            raise ValueError(f"Unknown instruction: {ins.mnemonic}")
+        return handler(self, ins.operands) & 0xFFFFFFFF
 
-    def encode_u_type(self, opcode: int, rd: int, imm: int) -> int:
-        return (opcode << 26) | (rd << 21) | (imm & 0x1FFFFF)
+    def assemble(self, source: str) -> 'array[int]':
+        self.first_pass(source)
+        return self.second_pass()
 
-    def first_pass(self, lines: List[str]):
-        self.current_address = 0
-        for line_num, line in enumerate(lines, 1):
-            line = line.split('#')[0].strip()
-            if not line:
-                continue
-            if ':' in line:
-                parts = line.split(':')
-                self.labels[parts[0].strip()] = self.current_address
-                line = ':'.join(parts[1:]).strip()
-                if not line:
-                    continue
-            if line.startswith('.'):
-                continue
-            self.current_address += 4
+    def to_hex(self, machine_code: Sequence[int]) -> str:
+        digits = _hex_digits(machine_code)
+        return '\n'.join(digits[i:i + 8] for i in range(0, len(digits), 8))
 
-    def second_pass(self, lines: List[str]) -> List[int]:
-        machine_code = []
-        self.current_address = 0
-        for line_num, line in enumerate(lines, 1):
-            line = line.split('#')[0].strip()
-            if not line:
-                continue
-            if ':' in line:
-                line = ':'.join(line.split(':')[1:]).strip()
-                if not line:
-                    continue
-            if line.startswith('.'):
-                continue
-            try:
-                code = self.assemble_instruction(line, line_num)
-                machine_code.append(code)
-                self.current_address += 4
-            except Exception as e:
-                print(f"Error at line {line_num}: {line}\n  {e}")
-                raise
-        return machine_code
-
-    def assemble_instruction(self, line: str, line_num: int) -> int:
-        parts = line.replace(',', ' ').split()
-        mnemonic = parts[0].upper()
-        operands = parts[1:] if len(parts) > 1 else []
-
-        # Pseudo-instructions
-        if mnemonic == 'NOP':
-            return self.encode_i_type(OPCODES['ADDI'], 0, 0, 0)
-        if mnemonic == 'MV':
-            return self.encode_i_type(OPCODES['ADDI'], self.parse_register(operands[0]),
-                                      self.parse_register(operands[1]), 0)
-        if mnemonic == 'LI':
-            rd = self.parse_register(operands[0])
-            imm = self.parse_immediate(operands[1])
-            if -32768 <= imm <= 32767:
-                return self.encode_i_type(OPCODES['ADDI'], rd, 0, imm)
-            raise ValueError(f"LI immediate too large: {imm}")
-        if mnemonic == 'J':
-            offset = self.parse_immediate(operands[0], self.labels, self.current_address, relative=True)
-            return self.encode_u_type(OPCODES['JAL'], 0, offset)
-
-        if mnemonic not in OPCODES:
-            raise ValueError(f"Unknown instruction: {mnemonic}")
-        opcode = OPCODES[mnemonic]
-
-        if mnemonic in R_TYPE:
-            if mnemonic == 'NOT':
-                return self.encode_r_type(opcode, self.parse_register(operands[0]),
-                                          self.parse_register(operands[1]), 0)
-            return self.encode_r_type(opcode, self.parse_register(operands[0]),
-                                      self.parse_register(operands[1]),
-                                      self.parse_register(operands[2]))
-
-        if mnemonic in I_TYPE:
-            return self.encode_i_type(opcode, self.parse_register(operands[0]),
-                                      self.parse_register(operands[1]),
-                                      self.parse_immediate(operands[2], self.labels))
-
-        if mnemonic in MEM_LOAD:
-            rd = self.parse_register(operands[0])
-            offset, rs1 = self.parse_memory_operand(operands[1])
-            return self.encode_i_type(opcode, rd, rs1, offset)
-
-        if mnemonic in MEM_STORE:
-            rs2 = self.parse_register(operands[0])
-            offset, rs1 = self.parse_memory_operand(operands[1])
-            return self.encode_s_type(opcode, rs2, rs1, offset)
-
-        if mnemonic in B_TYPE:
-            rs1 = self.parse_register(operands[0])
-            rs2 = self.parse_register(operands[1])
-            offset = self.parse_immediate(operands[2], self.labels, self.current_address, relative=True)
-            return self.encode_b_type(opcode, rs1, rs2, offset)
-
-        if mnemonic in U_TYPE:
-            if mnemonic == 'JAL':
-                rd = self.parse_register(operands[0])
-                offset = self.parse_immediate(operands[1], self.labels, self.current_address, relative=True)
-                return self.encode_u_type(opcode, rd, offset)
-            rd = self.parse_register(operands[0])
-            imm = self.parse_immediate(operands[1], self.labels)
-            return self.encode_u_type(opcode, rd, imm)
-
-        if mnemonic in CTRL_TYPE:
-            return opcode << 26
-
-        # FPU 2-operand (rd, rs1, rs2)
-        if mnemonic in FPU_R2:
-            return self.encode_r_type(opcode, self.parse_register(operands[0]),
-                                      self.parse_register(operands[1]),
-                                      self.parse_register(operands[2]))
-
-        # FPU 1-operand (rd, rs1)
-        if mnemonic in FPU_R1:
-            return self.encode_r_type(opcode, self.parse_register(operands[0]),
-                                      self.parse_register(operands[1]), 0)
-
-        # FPU 3-operand (rd, rs1, rs2, rs3) - rs3 encoded in func field [10:6]
-        if mnemonic in FPU_R3:
-            rd = self.parse_register(operands[0])
-            rs1 = self.parse_register(operands[1])
-            rs2 = self.parse_register(operands[2])
-            rs3 = self.parse_register(operands[3])
-            # rs3 goes in bits [10:6]
-            return (opcode << 26) | (rd << 21) | (rs1 << 16) | (rs2 << 11) | (rs3 << 6)
-
-        raise ValueError(f"Unhandled instruction: {mnemonic}")
-
-    def assemble(self, source: str) -> List[int]:
-        lines = source.split('\n')
-        self.first_pass(lines)
-        return self.second_pass(lines)
-
-    def to_hex(self, machine_code: List[int]) -> str:
-        return '\n'.join(f'{code:08x}' for code in machine_code)
-
-    def to_memh(self, machine_code: List[int]) -> str:
+    def to_memh(self, machine_code: Sequence[int]) -> str:
+        digits = _hex_digits(machine_code)
         lines = ['// OpenGPU machine code', '']
-        for i, code in enumerate(machine_code):
-            lines.append(f'{code:08x}  // addr {i*4:04x}')
+        # Eight hex digits per word, so the byte address is half the digit offset
+        lines.extend(f'{digits[i:i + 8]}  // addr {i >> 1:04x}'
+                     for i in range(0, len(digits), 8))
         return '\n'.join(lines)
 
+    def write_memh(self, machine_code: Sequence[int], f: TextIO) -> None:
+        # Writes exactly to_memh(machine_code) + '\n', so the file ends with a
+        # newline; line by line so the full output text is never held in memory
+        digits = _hex_digits(machine_code)
+        f.write('// OpenGPU machine code\n\n')
+        for i in range(0, len(digits), 8):
+            f.write(f'{digits[i:i + 8]}  // addr {i >> 1:04x}\n')
+
+
+def encode_all(asm: Assembler, table: InstructionTable) -> 'array[int]':
+    # Bulk emit loop: the jump table is bound to a local so each instruction
+    # costs one tuple index and one handler call. The output size is known
+    # from first_pass, so words go straight into a preallocated 32-bit array.
+    handlers = HANDLERS_ARR
+    machine_code = array('I', bytes(4 * len(table)))
+    for i, (mnemonic_id, ops) in enumerate(zip(table.mnemonic_ids, table.operands)):
+        asm.current_address = i << 2
+        try:
+            machine_code[i] = handlers[mnemonic_id](asm, ops) & 0xFFFFFFFF
+        except Exception as e:
+            print(f"Error at line {table.line_nums[i]}: {MNEMONICS[mnemonic_id]} {', '.join(ops)}\n  {e}")
+            raise
+    return machine_code
+
 
-def main():
+def main() -> None:
     if len(sys.argv) < 2:
         print("Usage: python opengpu_asm.py input.asm [output.hex]")
         sys.exit(1)
@@ -288,7 +427,7 @@ def main():
     try:
         machine_code = asm.assemble(source)
         with open(output_file, 'w') as f:
-            f.write(asm.to_memh(machine_code))
+            asm.write_memh(machine_code, f)
         print(f"Assembled {len(machine_code)} instructions to {output_file}")
         if asm.labels:
             print("\nLabels:")